@@ -44,6 +44,12 @@ def pytest_configure(config):
         "markers",
         "aws_integration: runs aws integration test that may be very slow and requires credentials",
     )
+    # Registered here as well so the marker is known when pytest-xdist is not installed
+    config.addinivalue_line(
+        "markers",
+        "xdist_group(name): with pytest-xdist and --dist=loadgroup, run all tests in the group "
+        "on the same worker so they share its module- and session-scoped fixtures.",
+    )
 
 
 def pytest_addoption(parser):
@@ -1881,12 +1887,26 @@ def sqlalchemy_dataset(test_backends):
     return get_dataset(backend, data, schemas=schemas, profiler=None)
 
 
+def set_sqlite_test_pragmas(dbapi_connection, connection_record):
+    """SqlAlchemy "connect" listener tuning sqlite for the in-memory test dbs.
+
+    Durability and cache pragmas (synchronous, journal_mode, cache_size) are not set since
+    an in-memory db never syncs to disk and already lives entirely in the page cache.
+    """
+    cursor = dbapi_connection.cursor()
+    # Keep temporary tables, including those built for query batches, out of temp files
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
 @pytest.fixture
 def sqlitedb_engine(test_backend):
     if test_backend == "sqlite":
         import sqlalchemy as sa
 
-        return sa.create_engine("sqlite://")
+        engine = sa.create_engine("sqlite://")
+        sa.event.listen(engine, "connect", set_sqlite_test_pragmas)
+        return engine
     else:
         pytest.skip("Skipping test designed for sqlite on non-sqlite backend.")
 
